@@ -0,0 +1,4 @@
+# Guilherme Azambuja
+# https://github.com/gvlk/fuzzy-land-pricing
+
+# Marks the repository root for pytest, so the tests can import the modules next to main.py
@@ -0,0 +1,61 @@
+# Guilherme Azambuja
+# https://github.com/gvlk/fuzzy-land-pricing
+
+"""
+Numba-compiled inference used by LandPricing. Kept apart from land_pricing so that importing it does not load Numba.
+"""
+
+import numpy as np
+from numba import njit
+
+import fuzzy_math
+
+bell = njit(cache=True)(fuzzy_math.bell)
+fire_rules = njit(cache=True)(fuzzy_math.fire_rules)
+
+
+@njit(cache=True)
+def mamdani(area: float, dist_ave: float, dist_bch: float,
+           area_centers: np.ndarray, area_widths: np.ndarray,
+           ave_centers: np.ndarray, ave_widths: np.ndarray,
+           bch_centers: np.ndarray, bch_widths: np.ndarray,
+           price_universe: np.ndarray, price_weights: np.ndarray, price_mfs: np.ndarray,
+           slope: int) -> float:
+    """
+    Compiled Mamdani inference for the rules of LandPricing.get_rules: bell fuzzification of the crisp inputs,
+    min/max rule evaluation, clip-and-max aggregation of the price terms and centroid defuzzification.
+
+    :param area: Area of the land, inside the area universe.
+    :param dist_ave: Distance from the avenue, inside its universe.
+    :param dist_bch: Distance from the beach, inside its universe.
+    :param area_centers: Bell centers of the area terms.
+    :param area_widths: Bell widths of the area terms.
+    :param ave_centers: Bell centers of the distance from the avenue terms.
+    :param ave_widths: Bell widths of the distance from the avenue terms.
+    :param bch_centers: Bell centers of the distance from the beach terms.
+    :param bch_widths: Bell widths of the distance from the beach terms.
+    :param price_universe: Universe of the price.
+    :param price_weights: Trapezoidal weights of the price universe.
+    :param price_mfs: Membership function of each price term sampled on the universe, one per row.
+    :param slope: Slope shared by all bells.
+    :return: Estimated price of the land.
+    """
+
+    area_act = bell(area, area_centers, area_widths, slope)
+    ave_act = bell(dist_ave, ave_centers, ave_widths, slope)
+    bch_act = bell(dist_bch, bch_centers, bch_widths, slope)
+
+    rule_act = fire_rules(area_act, ave_act, bch_act)
+
+    # Clip, aggregate and integrate in a single pass over the price universe
+    numerator = 0.0
+    denominator = 0.0
+    for i in range(price_universe.size):
+        degree = 0.0
+        for k in range(len(rule_act)):
+            degree = max(degree, min(rule_act[k], price_mfs[k, i]))
+        weighted = price_weights[i] * degree
+        numerator += price_universe[i] * weighted
+        denominator += weighted
+
+    return numerator / denominator
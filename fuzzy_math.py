@@ -0,0 +1,58 @@
+# Guilherme Azambuja
+# https://github.com/gvlk/fuzzy-land-pricing
+
+"""
+Membership and rule evaluation shared by land_pricing and fuzzy_kernel. Written in plain numpy that Numba can also
+compile, and without importing either module.
+"""
+
+from typing import Tuple, Union
+
+import numpy as np
+
+
+def bell(x: Union[float, np.ndarray], centers: np.ndarray, widths: np.ndarray,
+         slope: int) -> np.ndarray:
+    """
+    Membership in several generalized bells sharing the same integer slope. Slopes of at least 1 are raised by
+    repeated multiplication, smaller ones through pow.
+
+    :param x: Crisp input, or an array of inputs broadcasting against the bells.
+    :param centers: Center of each bell.
+    :param widths: Width of each bell.
+    :param slope: Slope shared by all bells.
+    :return: Membership degree of the input in each bell.
+    """
+
+    u = (x - centers) / widths
+    u2 = u * u
+    if slope < 1:
+        return 1.0 / (1.0 + u2 ** float(slope))
+
+    powered = u2
+    for _ in range(slope - 1):
+        powered = powered * u2
+
+    return 1.0 / (1.0 + powered)
+
+
+def fire_rules(area_act: np.ndarray, ave_act: np.ndarray,
+               bch_act: np.ndarray) -> Tuple[Union[float, np.ndarray], ...]:
+    """
+    The rules of LandPricing.get_rules written out with min as AND and max as OR. The memberships hold one entry per
+    term, either a degree or, for the area, an array of degrees when a batch of areas is evaluated.
+
+    :param area_act: Memberships of the area, in the order very_small, small, medium, large, very_large.
+    :param ave_act: Memberships of the distance from the avenue, in the order close, moderate, far.
+    :param bch_act: Memberships of the distance from the beach, in the order close, moderate, far.
+    :return: Firing strength of each rule, in the order of the price terms.
+    """
+
+    both_close = np.fmin(ave_act[0], bch_act[0])
+    return (
+        np.fmin(area_act[0], np.fmax(ave_act[2], bch_act[2])),
+        np.fmax(area_act[1], ave_act[1]),
+        np.fmax(area_act[2], np.fmax(ave_act[0], bch_act[0])),
+        np.fmax(area_act[3], both_close),
+        np.fmin(area_act[4], both_close)
+    )
@@ -1,14 +1,32 @@
 # Guilherme Azambuja
 # https://github.com/gvlk/fuzzy-land-pricing
 
-import skfuzzy as fuzz
 from skfuzzy import control as ctrl
 from skfuzzy.control import Antecedent, Consequent, Rule
 import numpy as np
 import matplotlib.pyplot as plt
-from typing import Tuple
+from typing import Tuple, Union
 from colorama import Fore
 
+from fuzzy_math import bell, fire_rules
+
+
+# Swaps the thousands and decimal separators: 1,234.56 -> 1.234,56
+_BRAZILIAN_SEPARATORS = str.maketrans(",.", ".,")
+
+
+def _bell_parameters(breakpoints: Tuple[float, ...]) -> Tuple[Tuple[float, ...], Tuple[float, ...]]:
+    """
+    Derive the bell of each term from consecutive breakpoints: the bell spans from one breakpoint to the next.
+
+    :param breakpoints: Sorted breakpoints of the variable, one more than the number of terms.
+    :return: Tuple[Tuple[float, ...], Tuple[float, ...]]: The width and the center of each bell.
+    """
+
+    widths = tuple((end - start) / 2 for start, end in zip(breakpoints, breakpoints[1:]))
+    centers = tuple(start + width for start, width in zip(breakpoints, widths))
+    return widths, centers
+
 
 class AreaConstants:
     P00 = 180
@@ -20,20 +38,9 @@ class AreaConstants:
     MIN = 100
     MAX = 500
     STEP = 1
-    BELL_WIDTHS = (
-        (P20 - P00) / 2,
-        (P40 - P20) / 2,
-        (P60 - P40) / 2,
-        (P80 - P60) / 2,
-        (P100 - P80) / 2
-    )
-    BELL_CENTERS = (
-        P00 + BELL_WIDTHS[0],
-        P20 + BELL_WIDTHS[1],
-        P40 + BELL_WIDTHS[2],
-        P60 + BELL_WIDTHS[3],
-        P80 + BELL_WIDTHS[4]
-    )
+    BELL_WIDTHS, BELL_CENTERS = _bell_parameters((P00, P20, P40, P60, P80, P100))
+    BELL_WIDTHS_ARR = np.asarray(BELL_WIDTHS, dtype=np.float32)
+    BELL_CENTERS_ARR = np.asarray(BELL_CENTERS, dtype=np.float32)
 
 
 class PriceConstants:
@@ -46,20 +53,10 @@ class PriceConstants:
     MIN = 20_000
     MAX = 500_000
     STEP = 1_000
-    BELL_WIDTHS = (
-        (P20 - P00) / 2,
-        (P40 - P20) / 2,
-        (P60 - P40) / 2,
-        (P80 - P60) / 2,
-        (P100 - P80) / 2
-    )
-    BELL_CENTERS = (
-        P00 + BELL_WIDTHS[0],
-        P20 + BELL_WIDTHS[1],
-        P40 + BELL_WIDTHS[2],
-        P60 + BELL_WIDTHS[3],
-        P80 + BELL_WIDTHS[4]
-    )
+    SAMPLES_PER_BELL = 64
+    BELL_WIDTHS, BELL_CENTERS = _bell_parameters((P00, P20, P40, P60, P80, P100))
+    BELL_WIDTHS_ARR = np.asarray(BELL_WIDTHS, dtype=np.float32)
+    BELL_CENTERS_ARR = np.asarray(BELL_CENTERS, dtype=np.float32)
 
 
 class DistAveConstants:
@@ -71,16 +68,9 @@ class DistAveConstants:
     MIN = 0.60
     MAX = 5.50
     STEP = 0.05
-    BELL_WIDTHS = (
-        (P33 - P00) / 2,
-        (P66 - P33) / 2,
-        (P100 - P66) / 2
-    )
-    BELL_CENTERS = (
-        P00 + BELL_WIDTHS[0],
-        P33 + BELL_WIDTHS[1],
-        P66 + BELL_WIDTHS[2]
-    )
+    BELL_WIDTHS, BELL_CENTERS = _bell_parameters((P00, P33, P66, P100))
+    BELL_WIDTHS_ARR = np.asarray(BELL_WIDTHS, dtype=np.float32)
+    BELL_CENTERS_ARR = np.asarray(BELL_CENTERS, dtype=np.float32)
 
 
 class DistBchConstants:
@@ -92,16 +82,65 @@ class DistBchConstants:
     MIN = 0.20
     MAX = 7.00
     STEP = 0.05
-    BELL_WIDTHS = (
-        (P33 - P00) / 2,
-        (P66 - P33) / 2,
-        (P100 - P66) / 2
-    )
-    BELL_CENTERS = (
-        P00 + BELL_WIDTHS[0],
-        P33 + BELL_WIDTHS[1],
-        P66 + BELL_WIDTHS[2]
-    )
+    BELL_WIDTHS, BELL_CENTERS = _bell_parameters((P00, P33, P66, P100))
+    BELL_WIDTHS_ARR = np.asarray(BELL_WIDTHS, dtype=np.float32)
+    BELL_CENTERS_ARR = np.asarray(BELL_CENTERS, dtype=np.float32)
+
+
+def _gbellmf_batch(universe: np.ndarray, widths: np.ndarray, slope: float, centers: np.ndarray) -> np.ndarray:
+    """
+    Evaluate several generalized bell membership functions sharing the same slope in one broadcast expression.
+
+    :param universe: Points where the functions are evaluated.
+    :param widths: Width of each bell.
+    :param slope: Slope shared by all bells.
+    :param centers: Center of each bell.
+    :return: Array with one column per bell, column k being skfuzzy.gbellmf(universe, widths[k], slope, centers[k]).
+             Float32 universes give float32 memberships.
+    """
+
+    x = np.asarray(universe)[..., None]
+    dtype = np.result_type(x.dtype, np.float32)
+    w = np.asarray(widths, dtype=dtype)
+    c = np.asarray(centers, dtype=dtype)
+    if float(slope).is_integer():
+        return bell(x, c, w, int(slope))
+
+    u = (x - c) / w
+    return 1.0 / (1.0 + (u * u) ** slope)
+
+
+def _concentrated_universe(widths: np.ndarray, centers: np.ndarray, lower: float, upper: float,
+                           samples_per_bell: int) -> np.ndarray:
+    """
+    Build a non-uniform universe sampled densely where the bells change, i.e. within three widths of each center.
+
+    :param widths: Width of each bell.
+    :param centers: Center of each bell.
+    :param lower: First point of the universe.
+    :param upper: Last point of the universe.
+    :param samples_per_bell: Number of points spread over each bell.
+    :return: Sorted universe without duplicated points, in the dtype of the bell parameters.
+    """
+
+    points = [np.linspace(c - 3 * w, c + 3 * w, samples_per_bell) for c, w in zip(centers, widths)]
+    points.append(np.array([lower, upper]))
+    return np.unique(np.clip(np.concatenate(points), lower, upper)).astype(centers.dtype)
+
+
+def _trapezoid_weights(universe: np.ndarray) -> np.ndarray:
+    """
+    Weights of the trapezoidal rule on a possibly non-uniform universe, so that the integral of f is weights @ f.
+
+    :param universe: Sorted universe.
+    :return: Weight of each point of the universe.
+    """
+
+    steps = np.diff(universe) / 2
+    weights = np.zeros_like(universe)
+    weights[:-1] += steps
+    weights[1:] += steps
+    return weights
 
 
 class LandPricing:
@@ -110,7 +149,7 @@ class LandPricing:
     def __init__(self) -> None:
         """
         Initialize the LandPricing class by creating antecedents, consequent, and fuzzy control rules.
-        Also, initialize the control system and simulation, and visualize the membership functions.
+        Also, initialize the control system and simulation. Call visualize to plot the membership functions.
 
         :return: None
         """
@@ -122,6 +161,17 @@ class LandPricing:
         self.land_pricing_ctrl = ctrl.ControlSystem(self.rules)
         self.land_pricing_sim = ctrl.ControlSystemSimulation(self.land_pricing_ctrl)
 
+        self._price_mfs = np.array([term.mf for term in self.price_con.terms.values()])
+        self._price_weights = _trapezoid_weights(self.price_con.universe)
+        self._mamdani = None
+
+    def visualize(self) -> None:
+        """
+        Visualize the membership functions of every variable and plot the relationship between area and price.
+
+        :return: None
+        """
+
         self.area_ant.view()
         self.dist_ave_ant.view()
         self.dist_bch_ant.view()
@@ -136,50 +186,37 @@ class LandPricing:
         """
 
         area_ant = ctrl.Antecedent(
-            np.arange(AreaConstants.MIN, AreaConstants.MAX, AreaConstants.STEP), "area"
+            np.arange(AreaConstants.MIN, AreaConstants.MAX, AreaConstants.STEP, dtype=np.float32), "area"
         )
         dist_ave_ant = ctrl.Antecedent(
-            np.arange(DistAveConstants.MIN, DistAveConstants.MAX, DistAveConstants.STEP), "dist_ave"
+            np.arange(DistAveConstants.MIN, DistAveConstants.MAX, DistAveConstants.STEP, dtype=np.float32), "dist_ave"
         )
         dist_bch_ant = ctrl.Antecedent(
-            np.arange(DistBchConstants.MIN, DistBchConstants.MAX, DistBchConstants.STEP), "dist_bch"
+            np.arange(DistBchConstants.MIN, DistBchConstants.MAX, DistBchConstants.STEP, dtype=np.float32), "dist_bch"
         )
 
-        area_ant["very_small"] = fuzz.gbellmf(
-            area_ant.universe, AreaConstants.BELL_WIDTHS[0], self.BELL_SLOPE, AreaConstants.BELL_CENTERS[0]
-        )
-        area_ant["small"] = fuzz.gbellmf(
-            area_ant.universe, AreaConstants.BELL_WIDTHS[1], self.BELL_SLOPE, AreaConstants.BELL_CENTERS[1]
-        )
-        area_ant["medium"] = fuzz.gbellmf(
-            area_ant.universe, AreaConstants.BELL_WIDTHS[2], self.BELL_SLOPE, AreaConstants.BELL_CENTERS[2]
-        )
-        area_ant["large"] = fuzz.gbellmf(
-            area_ant.universe, AreaConstants.BELL_WIDTHS[3], self.BELL_SLOPE, AreaConstants.BELL_CENTERS[3]
+        area_mfs = _gbellmf_batch(
+            area_ant.universe, AreaConstants.BELL_WIDTHS_ARR, self.BELL_SLOPE, AreaConstants.BELL_CENTERS_ARR
         )
-        area_ant["very_large"] = fuzz.gbellmf(
-            area_ant.universe, AreaConstants.BELL_WIDTHS[4], self.BELL_SLOPE, AreaConstants.BELL_CENTERS[4]
+        area_ant["very_small"] = area_mfs[:, 0]
+        area_ant["small"] = area_mfs[:, 1]
+        area_ant["medium"] = area_mfs[:, 2]
+        area_ant["large"] = area_mfs[:, 3]
+        area_ant["very_large"] = area_mfs[:, 4]
+
+        dist_ave_mfs = _gbellmf_batch(
+            dist_ave_ant.universe, DistAveConstants.BELL_WIDTHS_ARR, self.BELL_SLOPE, DistAveConstants.BELL_CENTERS_ARR
         )
+        dist_ave_ant["close"] = dist_ave_mfs[:, 0]
+        dist_ave_ant["moderate"] = dist_ave_mfs[:, 1]
+        dist_ave_ant["far"] = dist_ave_mfs[:, 2]
 
-        dist_ave_ant["close"] = fuzz.gbellmf(
-            dist_ave_ant.universe, DistAveConstants.BELL_WIDTHS[0], self.BELL_SLOPE, DistAveConstants.BELL_CENTERS[0]
-        )
-        dist_ave_ant["moderate"] = fuzz.gbellmf(
-            dist_ave_ant.universe, DistAveConstants.BELL_WIDTHS[1], self.BELL_SLOPE, DistAveConstants.BELL_CENTERS[1]
-        )
-        dist_ave_ant["far"] = fuzz.gbellmf(
-            dist_ave_ant.universe, DistAveConstants.BELL_WIDTHS[2], self.BELL_SLOPE, DistAveConstants.BELL_CENTERS[2]
-        )
-
-        dist_bch_ant["close"] = fuzz.gbellmf(
-            dist_bch_ant.universe, DistBchConstants.BELL_WIDTHS[0], self.BELL_SLOPE, DistBchConstants.BELL_CENTERS[0]
-        )
-        dist_bch_ant["moderate"] = fuzz.gbellmf(
-            dist_bch_ant.universe, DistBchConstants.BELL_WIDTHS[1], self.BELL_SLOPE, DistBchConstants.BELL_CENTERS[1]
-        )
-        dist_bch_ant["far"] = fuzz.gbellmf(
-            dist_bch_ant.universe, DistBchConstants.BELL_WIDTHS[2], self.BELL_SLOPE, DistBchConstants.BELL_CENTERS[2]
+        dist_bch_mfs = _gbellmf_batch(
+            dist_bch_ant.universe, DistBchConstants.BELL_WIDTHS_ARR, self.BELL_SLOPE, DistBchConstants.BELL_CENTERS_ARR
         )
+        dist_bch_ant["close"] = dist_bch_mfs[:, 0]
+        dist_bch_ant["moderate"] = dist_bch_mfs[:, 1]
+        dist_bch_ant["far"] = dist_bch_mfs[:, 2]
 
         return area_ant, dist_ave_ant, dist_bch_ant
 
@@ -190,23 +227,23 @@ class LandPricing:
         :return: Consequent: The price consequent.
         """
 
-        price_con = ctrl.Consequent(np.arange(PriceConstants.MIN, PriceConstants.MAX, PriceConstants.STEP), "price")
-
-        price_con["very_low"] = fuzz.gbellmf(
-            price_con.universe, PriceConstants.BELL_WIDTHS[0], self.BELL_SLOPE, PriceConstants.BELL_CENTERS[0]
-        )
-        price_con["low"] = fuzz.gbellmf(
-            price_con.universe, PriceConstants.BELL_WIDTHS[1], self.BELL_SLOPE, PriceConstants.BELL_CENTERS[1]
-        )
-        price_con["medium"] = fuzz.gbellmf(
-            price_con.universe, PriceConstants.BELL_WIDTHS[2], self.BELL_SLOPE, PriceConstants.BELL_CENTERS[2]
-        )
-        price_con["high"] = fuzz.gbellmf(
-            price_con.universe, PriceConstants.BELL_WIDTHS[3], self.BELL_SLOPE, PriceConstants.BELL_CENTERS[3]
+        # Same bounds as np.arange(MIN, MAX, STEP), with the points concentrated around the bells
+        price_con = ctrl.Consequent(
+            _concentrated_universe(
+                PriceConstants.BELL_WIDTHS_ARR, PriceConstants.BELL_CENTERS_ARR,
+                PriceConstants.MIN, PriceConstants.MAX - PriceConstants.STEP, PriceConstants.SAMPLES_PER_BELL
+            ),
+            "price"
         )
-        price_con["very_high"] = fuzz.gbellmf(
-            price_con.universe, PriceConstants.BELL_WIDTHS[4], self.BELL_SLOPE, PriceConstants.BELL_CENTERS[4]
+
+        price_mfs = _gbellmf_batch(
+            price_con.universe, PriceConstants.BELL_WIDTHS_ARR, self.BELL_SLOPE, PriceConstants.BELL_CENTERS_ARR
         )
+        price_con["very_low"] = price_mfs[:, 0]
+        price_con["low"] = price_mfs[:, 1]
+        price_con["medium"] = price_mfs[:, 2]
+        price_con["high"] = price_mfs[:, 3]
+        price_con["very_high"] = price_mfs[:, 4]
 
         return price_con
 
@@ -247,10 +284,7 @@ class LandPricing:
         """
 
         areas = np.arange(AreaConstants.P00, AreaConstants.P100, 1)
-        prices = []
-
-        for area in areas:
-            prices.append(self._run(area, DistAveConstants.AVERAGE, DistBchConstants.AVERAGE))
+        prices = self._run_batch(areas, DistAveConstants.AVERAGE, DistBchConstants.AVERAGE)
 
         fig, ax = plt.subplots()
         ax.plot(prices, areas, label="Fuzzy System Output")
@@ -264,6 +298,35 @@ class LandPricing:
 
         plt.show()
 
+    def plot_price(self, area: float, dist_ave: float, dist_bch: float, price: float) -> None:
+        """
+        Plot the price membership functions, each one filled up to the firing strength of its rule for the given input,
+        and the estimated price.
+
+        :param area: Area of the land.
+        :param dist_ave: Distance from the avenue.
+        :param dist_bch: Distance from the beach.
+        :param price: Estimated price of the land for this input.
+        :return: None
+        """
+
+        area_act = self._fuzzify(area, self.area_ant, AreaConstants)
+        rule_act = fire_rules(area_act, *self._fuzzify_dists(dist_ave, dist_bch))
+        universe = self.price_con.universe
+
+        fig, ax = plt.subplots()
+        for label, mf, act in zip(self.price_con.terms, self._price_mfs, rule_act):
+            line, = ax.plot(universe, mf, linewidth=1.5, label=label)
+            ax.fill_between(universe, 0, np.fmin(act, mf), facecolor=line.get_color(), alpha=0.4)
+        ax.plot([price, price], [0, 1], color="k", linewidth=3, label="crisp value")
+
+        ax.set_ylim(0, 1.01)
+        ax.set_xlabel("price")
+        ax.set_ylabel("Membership")
+        ax.legend()
+
+        fig.show()
+
     @staticmethod
     def compare_to_real_price(recommended: float, real: float) -> None:
         """
@@ -284,7 +347,7 @@ class LandPricing:
 
         print(message)
 
-    def _run(self, area: float, dist_ave: float, dist_bch: float) -> float:
+    def _simulate(self, area: float, dist_ave: float, dist_bch: float) -> float:
         """
         Run the fuzzy control system simulation with the given input and return the estimated price.
 
@@ -294,15 +357,93 @@ class LandPricing:
         :return: Estimated price of the land.
         """
 
-        self.land_pricing_sim.input["area"] = area
-        self.land_pricing_sim.input["dist_ave"] = dist_ave
-        self.land_pricing_sim.input["dist_bch"] = dist_bch
+        self.land_pricing_sim.inputs({"area": area, "dist_ave": dist_ave, "dist_bch": dist_bch})
         self.land_pricing_sim.compute()
         return self.land_pricing_sim.output["price"]
 
+    def _fuzzify(self, value: Union[float, np.ndarray], antecedent: Antecedent, constants: type) -> np.ndarray:
+        """
+        Compute the membership of a crisp value (or array of values) in each term of an antecedent, evaluating the
+        bells analytically at the input instead of interpolating them on the universe.
+
+        :param value: Crisp input, clipped to the universe of the antecedent.
+        :param antecedent: Antecedent whose terms are evaluated.
+        :param constants: Constants class holding the bell parameters of the antecedent.
+        :return: Membership degree of the input in each term, one row per term in the order of antecedent.terms.
+        """
+
+        # Deliberately not skfuzzy's interp_membership: the moderate bell of the distance from the avenue is 0.055km
+        # wide on a 0.05km grid, so interpolating it is off by up to 0.42 of membership (0.21 instead of 0.07 at
+        # 1.77km). Between grid points the price can then differ from the simulation by up to about 5%, against
+        # under 0.2% on the grid itself. tests/test_rules.py pins one such input.
+        value = np.clip(value, antecedent.universe[0], antecedent.universe[-1])
+        memberships = _gbellmf_batch(value, constants.BELL_WIDTHS_ARR, self.BELL_SLOPE, constants.BELL_CENTERS_ARR)
+        return np.ascontiguousarray(np.moveaxis(memberships, -1, 0))
+
+    def _fuzzify_dists(self, dist_ave: float, dist_bch: float) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Compute the membership of both distances in their terms, so that they can be reused across several areas.
+
+        :param dist_ave: Distance from the avenue.
+        :param dist_bch: Distance from the beach.
+        :return: Tuple[np.ndarray, np.ndarray]: Membership degrees of the distance from the avenue and from the beach.
+        """
+
+        return (
+            self._fuzzify(float(dist_ave), self.dist_ave_ant, DistAveConstants),
+            self._fuzzify(float(dist_bch), self.dist_bch_ant, DistBchConstants)
+        )
+
+    def _run(self, area: float, dist_ave: float, dist_bch: float) -> float:
+        """
+        Run the compiled Mamdani inference of fuzzy_kernel, without the control system graph. The kernel module,
+        and Numba with it, is only imported on the first call.
+
+        :param area: Area of the land.
+        :param dist_ave: Distance from the avenue.
+        :param dist_bch: Distance from the beach.
+        :return: Estimated price of the land.
+        """
+
+        if self._mamdani is None:
+            from fuzzy_kernel import mamdani
+            self._mamdani = mamdani
+
+        return self._mamdani(
+            float(np.clip(area, self.area_ant.universe[0], self.area_ant.universe[-1])),
+            float(np.clip(dist_ave, self.dist_ave_ant.universe[0], self.dist_ave_ant.universe[-1])),
+            float(np.clip(dist_bch, self.dist_bch_ant.universe[0], self.dist_bch_ant.universe[-1])),
+            AreaConstants.BELL_CENTERS_ARR, AreaConstants.BELL_WIDTHS_ARR,
+            DistAveConstants.BELL_CENTERS_ARR, DistAveConstants.BELL_WIDTHS_ARR,
+            DistBchConstants.BELL_CENTERS_ARR, DistBchConstants.BELL_WIDTHS_ARR,
+            self.price_con.universe,
+            self._price_weights,
+            self._price_mfs,
+            self.BELL_SLOPE
+        )
+
+    def _run_batch(self, areas: np.ndarray, dist_ave: float, dist_bch: float) -> np.ndarray:
+        """
+        Run the fuzzy inference for several areas at once, sharing the same distances, and return the estimated prices.
+        The distances are fuzzified once and the rules are evaluated over the whole batch.
+
+        :param areas: Areas of the land.
+        :param dist_ave: Distance from the avenue.
+        :param dist_bch: Distance from the beach.
+        :return: Estimated prices of the land, one per area.
+        """
+
+        rule_act = np.array(fire_rules(
+            self._fuzzify(areas, self.area_ant, AreaConstants),
+            *self._fuzzify_dists(dist_ave, dist_bch)
+        ))
+        aggregated = np.fmax.reduce(np.fmin(rule_act[:, :, None], self._price_mfs[:, None, :]), axis=0)
+
+        return aggregated @ (self._price_weights * self.price_con.universe) / (aggregated @ self._price_weights)
+
     def run(self, area: float, dist_ave: float, dist_bch: float) -> float:
         """
-        Run the fuzzy control system simulation with the given input, print the estimated price, and return it.
+        Estimate the price for the given input, print it, and return it.
 
         :param area: Area of the land.
         :param dist_ave: Distance from the avenue.
@@ -311,12 +452,8 @@ class LandPricing:
         """
 
         answer = self._run(area, dist_ave, dist_bch)
-        formatted_answer = (
-            "Recommended price:{} R$ {:,.2f}{}"
-            .format(Fore.GREEN, answer, Fore.RESET)
-            .replace(",", "v")
-            .replace(".", ",")
-            .replace("v", ".")
+        formatted_answer = "Recommended price:{} R$ {}{}".format(
+            Fore.GREEN, "{:,.2f}".format(answer).translate(_BRAZILIAN_SEPARATORS), Fore.RESET
         )
 
         print("Area: {:.0f}m²".format(area))
@@ -324,6 +461,7 @@ class LandPricing:
         print("Distance from the beach: {:.2f}km".format(dist_bch))
         print()
         print(formatted_answer)
-        self.price_con.view(sim=self.land_pricing_sim)
+
+        self.plot_price(area, dist_ave, dist_bch, answer)
 
         return answer
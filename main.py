@@ -18,6 +18,7 @@ from land_pricing import LandPricing
 
 def main() -> None:
     land_pricing = LandPricing()
+    land_pricing.visualize()
 
     while True:
         area = float(input("\nEnter the area(m²): "))
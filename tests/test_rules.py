@@ -0,0 +1,69 @@
+# Guilherme Azambuja
+# https://github.com/gvlk/fuzzy-land-pricing
+
+"""
+Checks the direct inference of LandPricing against the skfuzzy control system it replaces.
+"""
+
+import numpy as np
+import pytest
+
+from fuzzy_math import fire_rules
+from land_pricing import AreaConstants, DistAveConstants, DistBchConstants, LandPricing
+
+RULE_SAMPLES = (
+    (AreaConstants.P00, DistAveConstants.P00, DistBchConstants.P00),
+    (AreaConstants.P40, DistAveConstants.P33, DistBchConstants.P66),
+    (AreaConstants.P60, DistAveConstants.AVERAGE, DistBchConstants.AVERAGE),
+    (AreaConstants.P100, DistAveConstants.P66, DistBchConstants.P33),
+    (AreaConstants.P80, DistAveConstants.P100, DistBchConstants.P100)
+)
+
+# Points of the input universes, away from the narrow moderate bells where the analytic memberships of the direct
+# inference depart from the interpolated ones of the simulation
+PRICE_SAMPLES = (
+    (120, 0.80, 0.50),
+    (250, 1.20, 1.00),
+    (330, 2.30, 1.98),
+    (410, 3.50, 4.00),
+    (490, 5.00, 6.50),
+    (490, 0.80, 1.98)
+)
+
+
+@pytest.fixture(scope="module")
+def land_pricing() -> LandPricing:
+    return LandPricing()
+
+
+@pytest.mark.parametrize("sample", RULE_SAMPLES)
+def test_fire_rules_matches_get_rules(land_pricing: LandPricing, sample: tuple) -> None:
+    sim = land_pricing.land_pricing_sim
+    land_pricing._simulate(*sample)
+
+    memberships = [
+        np.array([term.membership_value[sim] for term in antecedent.terms.values()])
+        for antecedent in (land_pricing.area_ant, land_pricing.dist_ave_ant, land_pricing.dist_bch_ant)
+    ]
+    expected = [rule.aggregate_firing[sim] for rule in land_pricing.rules]
+
+    assert np.allclose(fire_rules(*memberships), expected)
+
+
+@pytest.mark.parametrize("sample", PRICE_SAMPLES)
+def test_run_matches_simulation(land_pricing: LandPricing, sample: tuple) -> None:
+    assert land_pricing._run(*sample) == pytest.approx(land_pricing._simulate(*sample), rel=5e-3)
+
+
+@pytest.mark.parametrize("dist_ave, dist_bch", [(0.80, 0.50), (DistAveConstants.AVERAGE, DistBchConstants.AVERAGE)])
+def test_run_batch_matches_run(land_pricing: LandPricing, dist_ave: float, dist_bch: float) -> None:
+    areas = np.arange(AreaConstants.MIN, AreaConstants.MAX, 10.0)
+    expected = [land_pricing._run(area, dist_ave, dist_bch) for area in areas]
+
+    assert land_pricing._run_batch(areas, dist_ave, dist_bch) == pytest.approx(expected, rel=1e-6)
+
+
+def test_run_evaluates_bells_between_grid_points(land_pricing: LandPricing) -> None:
+    # 1.77km sits between grid points of the narrow moderate bell, where the simulation interpolates a membership of
+    # 0.21 instead of 0.07 and estimates about 201,923 instead
+    assert land_pricing._run(410, 1.77, 1.98) == pytest.approx(212620.92, rel=1e-5)